@@ -1,14 +1,53 @@
+import asyncio
+import codecs
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import tomllib
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Optional, Union
+from typing import (
+    Any,
+    AsyncIterable,
+    Dict,
+    List,
+    Optional,
+    Set,
+    TextIO,
+    Tuple,
+    Union,
+)
 from typing_extensions import Annotated
 
 import google.generativeai as genai
 import toml
 import typer
-from rich import print
 
 app = typer.Typer(no_args_is_help=True)
 
+MODEL_NAME = "gemini-1.5-flash"
+MAX_WORKERS = 16
+SYSTEM_INSTRUCTION = "You are a good programmer. Expert at documenting code. You will be passed code that may or may not have documentation. Your job will be to write the documentation for this code inside the code. If the code is in python you are going to put strong typing in it, otherwise you are not going to change the code. Your ourput will be only the code, without markdown code fences. The documentation will be in {language}"
+CACHE_DIR = Path.home() / ".cache" / "docsai"
+CACHE_VERSION = 1
+BATCH_PROMPT = "You will receive several files. Each one starts with a marker line like `===FILE 0: name===`. Document every file and answer with each documented file preceded by the exact same marker line, in the same order."
+BATCH_MAX_FILES = 8
+BATCH_MAX_CHARS = 32_000
+BATCH_MARKER = re.compile(r"^===FILE (\d+): .*===[ \t]*$", re.MULTILINE)
+
+SourceEncoding = Tuple[str, bool]
+UTF8: SourceEncoding = ("utf-8", False)
+BOMS = (
+    (codecs.BOM_UTF8, "utf-8"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"),
+    (codecs.BOM_UTF16_BE, "utf-16-be"),
+)
+
+_CONFIG_CACHE: Dict[Tuple[Path, int], Dict[str, Any]] = {}
+
 
 @app.command()
 def document(
@@ -19,6 +58,9 @@ def document(
     language: Annotated[
         Optional[str], typer.Option(help="Language for the documentation")
     ] = "english",
+    cache: Annotated[
+        bool, typer.Option(help="Reuse documentation generated for unchanged files")
+    ] = True,
 ) -> None:
     """
     Document code files using a generative AI model.
@@ -27,13 +69,61 @@ def document(
         files (List[Path]): List of file paths to document.
         replace (bool, optional): Whether to replace the original files with the documented versions. Defaults to False.
         language (Optional[str], optional): Language for the documentation. Defaults to 'english'.
+        cache (bool, optional): Whether to reuse previously generated documentation. Defaults to True.
     """
-    model = genai.GenerativeModel(
-        model_name="gemini-1.5-flash",
-        system_instruction=f"You are a good programmer. Expert at documenting code. You will be passed code that may or may not have documentation. Your job will be to write the documentation for this code inside the code. If the code is in python you are going to put strong typing in it, otherwise you are not going to change the code. Your ourput will be only the code. The documentation will be in {language}",
-    )
     init_config()
-    handling_files(files=files, replace=replace, model=model)
+    files, missing = split_existing_files(files)
+
+    for file in missing:
+        if file.is_dir():
+            typer.secho(f"{file} is a directory, not a file", fg="red", err=True)
+        else:
+            typer.secho(f"The file {file} doesn't exist", fg="red", err=True)
+
+    if files:
+        model = get_model(language)
+        handling_files(
+            files=files, replace=replace, model=model, language=language, cache=cache
+        )
+
+    if missing:
+        raise typer.Exit(code=1)
+
+
+@lru_cache(maxsize=16)
+def system_instruction(language: str) -> str:
+    """
+    Returns the system instruction for `language`, sharing the same string across models.
+
+    Args:
+        language (str): Language for the documentation.
+
+    Returns:
+        str: The system instruction given to the model.
+    """
+
+    return SYSTEM_INSTRUCTION.format(language=language)
+
+
+@lru_cache(maxsize=8)
+def get_model(language: str) -> genai.GenerativeModel:
+    """
+    Builds the generative AI model that documents code in `language`.
+
+    The model is built once per language and reused afterwards.
+
+    Args:
+        language (str): Language for the documentation.
+
+    Returns:
+        genai.GenerativeModel: The configured model.
+    """
+
+    return genai.GenerativeModel(
+        model_name=MODEL_NAME,
+        system_instruction=system_instruction(language),
+        generation_config=genai.types.GenerationConfig(response_mime_type="text/plain"),
+    )
 
 
 @app.command()
@@ -61,8 +151,7 @@ def config(
     """
 
     try:
-        with open(config_path, "r") as file:
-            config_file = toml.load(file)
+        config_file = tomllib.loads(config_path.read_text(encoding="utf-8"))
     except FileNotFoundError:
         typer.echo(f"Configuration file not found at {config_path}, please create one.")
         raise typer.Exit(code=1)
@@ -76,8 +165,7 @@ def config(
     config_file["API"]["API_KEY"] = api_key
     config_file["PATH"]["PATH"] = config_path
 
-    with open(config_path, "w") as file:
-        toml.dump(config_file, file)
+    config_path.write_text(toml.dumps(config_file), encoding="utf-8")
 
 
 def init_config() -> None:
@@ -107,6 +195,7 @@ def init_config() -> None:
 def load_config(config_path: Path) -> Union[str, bool]:
     """
     Loads the configuration file and returns the API key.
+    The parsed file is kept in memory until its modification time changes.
 
     Args:
         config_path (Path): The path to the configuration file.
@@ -115,21 +204,72 @@ def load_config(config_path: Path) -> Union[str, bool]:
         Union[str, bool]: The API key if found, otherwise False.
     """
 
+    key = (config_path, config_path.stat().st_mtime_ns)
+    config_file = _CONFIG_CACHE.get(key)
+
+    if config_file is None:
+        config_file = tomllib.loads(config_path.read_text(encoding="utf-8"))
+        _CONFIG_CACHE[key] = config_file
+
     try:
-        with open(config_path, "r") as file:
-            config_file = toml.load(file)
-            api_key = config_file["API"]["API_KEY"]
+        api_key = config_file["API"]["API_KEY"]
         return api_key
 
     except KeyError:
         return False
 
 
+def clear_config_cache() -> None:
+    """
+    Forgets every configuration file parsed by `load_config`.
+    """
+
+    _CONFIG_CACHE.clear()
+
+
+def split_existing_files(files: List[Path]) -> Tuple[List[Path], List[Path]]:
+    """
+    Separates the files that exist from the missing ones.
+
+    Each parent directory is listed once with `os.scandir`, instead of checking every file on its own.
+    Files not found in the listing, e.g. because of a case-insensitive filesystem or an
+    unlistable directory, are checked on their own before being reported as missing.
+
+    Args:
+        files (List[Path]): List of file paths to check.
+
+    Returns:
+        Tuple[List[Path], List[Path]]: The existing files and the missing ones, in their original order.
+        Directories are counted as missing.
+    """
+
+    names: Dict[Path, Set[str]] = {}
+
+    for parent in {file.parent for file in files}:
+        try:
+            with os.scandir(parent) as entries:
+                names[parent] = {entry.name for entry in entries if entry.is_file()}
+        except OSError:
+            names[parent] = set()
+
+    existing: List[Path] = []
+    missing: List[Path] = []
+
+    for file in files:
+        if file.name in names[file.parent] or file.is_file():
+            existing.append(file)
+        else:
+            missing.append(file)
+
+    return existing, missing
+
+
 def handling_files(
     files: List[Path],
     replace: bool,
     model: genai.GenerativeModel,
-    output_file: Optional[Path] = None,
+    language: str,
+    cache: bool = True,
 ) -> None:
     """
     Handles the documentation of individual files.
@@ -138,31 +278,707 @@ def handling_files(
         files (List[Path]): List of file paths to document.
         replace (bool): Whether to replace the original files with the documented versions.
         model (genai.GenerativeModel): The generative AI model to use for documentation.
-        output_file (Optional[Path]): The path to the output file. If not provided, the output file will be named `doc_{file}`.
+        language (str): Language of the documentation, part of the cache key.
+        cache (bool): Whether to reuse previously generated documentation.
     """
 
-    for file in files:
+    failed = asyncio.run(
+        document_files(
+            files=files, replace=replace, model=model, language=language, cache=cache
+        )
+    )
+
+    if failed:
+        raise typer.Exit(code=1)
+
+
+async def document_files(
+    files: List[Path],
+    replace: bool,
+    model: genai.GenerativeModel,
+    language: str,
+    cache: bool = True,
+) -> bool:
+    """
+    Documents the files concurrently, reporting each one as soon as it is written.
+
+    A pool of up to `MAX_WORKERS` workers takes work from a queue, so a new request
+    starts as soon as any other one finishes and the disk I/O of some files overlaps
+    with the requests of others. A work item is either a single file or a batch of
+    files sent in one request; the files of a batch are written as soon as it returns,
+    and the ones missing from its answer go back to the queue on their own.
+
+    Files with the same content are documented once and the result is written to each of them.
+
+    Args:
+        files (List[Path]): List of file paths to document.
+        replace (bool): Whether to replace the original files with the documented versions.
+            Otherwise each file is written next to the original as `doc_{file}`.
+        model (genai.GenerativeModel): The generative AI model to use for documentation.
+        language (str): Language of the documentation, part of the cache key.
+        cache (bool): Whether to reuse previously generated documentation.
+
+    Returns:
+        bool: True if any file could not be documented.
+    """
+
+    resolved_files = [file.resolve() for file in files]
+    out_paths = [
+        file if replace else file.with_name(f"doc_{file.name}")
+        for file in resolved_files
+    ]
+
+    pending: List[int] = []
+
+    for index, file in enumerate(files):
+        if cache and await asyncio.to_thread(
+            is_up_to_date,
+            resolved_files[index],
+            out_paths[index],
+            language,
+            model.model_name,
+        ):
+            typer.echo(f"Documentation for {file.name} is up to date")
+        else:
+            pending.append(index)
+
+    failed = False
+
+    def report(index: int, error: Optional[Exception]) -> None:
+        nonlocal failed
+        file = files[index]
+
+        if error is None:
+            typer.echo(f"Documentation for {file.name} ready")
 
-        if replace:
-            output_file: Path = Path(file).resolve()
+        elif isinstance(error, FileNotFoundError):
+            typer.secho(f"The file {file} doesn't exist", fg="red", err=True)
+            failed = True
 
         else:
-            output_file: Path = Path(file).resolve().with_name(f"doc_{file.name}")
+            typer.secho(f"Could not document {file}: {error}", fg="red", err=True)
+            failed = True
+
+    read_results = await asyncio.gather(
+        *(
+            asyncio.to_thread(read_source, resolved_files[index], replace)
+            for index in pending
+        ),
+        return_exceptions=True,
+    )
+
+    groups: Dict[str, List[int]] = {}
+    contents: Dict[str, str] = {}
+    states: Dict[int, Dict[str, Any]] = {}
+    encodings: Dict[int, SourceEncoding] = {}
+
+    for index, result in zip(pending, read_results):
+        if isinstance(result, Exception):
+            report(index, result)
+            continue
+
+        file_content, states[index], encodings[index] = result
+
+        key = cache_key(file_content, language, model.model_name)
+        groups.setdefault(key, []).append(index)
+        contents[key] = file_content
+
+    docs: Dict[str, str] = {}
+
+    if cache:
+        for key in groups:
+            doc_code = await asyncio.to_thread(read_cache, key)
+
+            if doc_code is not None:
+                docs[key] = doc_code
+
+    missing_docs = {
+        key: (resolved_files[indices[0]].name, contents[key])
+        for key, indices in groups.items()
+        if key not in docs
+    }
+
+    queue: asyncio.Queue[List[str]] = asyncio.Queue()
+    results: asyncio.Queue[Tuple[List[int], Optional[Exception]]] = asyncio.Queue()
+    batched: Set[str] = set()
+
+    for batch in split_batches(missing_docs):
+        if len(batch) > 1:
+            queue.put_nowait(list(batch))
+            batched.update(batch)
+
+    for key in groups:
+        if key not in batched:
+            queue.put_nowait([key])
+
+    async def write_group(key: str, doc_code: Optional[str]) -> None:
+        indices = groups[key]
 
         try:
-            with open(file.resolve(), "r") as code_file:
-                file_content = code_file.read()
-                doc_code = model.generate_content(file_content).text
-                doc_code = doc_code.splitlines()[1:-1]
-                doc_code = "\n".join(doc_code)
-
-            with open(output_file, "w") as out_file:
-                out_file.write(doc_code)
-                typer.echo(f"Documentation for {file.name} ready")
-
-        except FileNotFoundError:
-            print(f"The file {file} doesn't exist")
-            raise typer.Exit(code=1)
+            await process_file(
+                contents[key],
+                key,
+                list(
+                    dict.fromkeys(
+                        (out_paths[index], encodings[index]) for index in indices
+                    )
+                ),
+                model,
+                doc_code,
+            )
+
+            for index in indices:
+                state = states[index]
+
+                if out_paths[index] == resolved_files[index]:
+                    state = await asyncio.to_thread(file_state, out_paths[index])
+
+                await asyncio.to_thread(
+                    write_sidecar,
+                    out_paths[index],
+                    language,
+                    model.model_name,
+                    state,
+                )
+        except Exception as error:
+            await results.put((indices, error))
+        else:
+            await results.put((indices, None))
+
+    async def worker() -> None:
+        while True:
+            keys = await queue.get()
+
+            if len(keys) == 1:
+                await write_group(keys[0], docs.get(keys[0]))
+                continue
+
+            try:
+                batch_docs = await batch_generate(
+                    sources={key: missing_docs[key] for key in keys}, model=model
+                )
+            except Exception as error:
+                typer.secho(
+                    f"Batched request failed, documenting its files one by one: {error}",
+                    fg="yellow",
+                    err=True,
+                )
+                batch_docs = {}
+
+            for key in keys:
+                if key not in batch_docs:
+                    queue.put_nowait([key])
+
+            await asyncio.gather(
+                *(write_group(key, doc_code) for key, doc_code in batch_docs.items())
+            )
+
+    workers = [
+        asyncio.create_task(worker()) for _ in range(min(len(groups), MAX_WORKERS))
+    ]
+
+    try:
+        for _ in range(len(groups)):
+            indices, error = await results.get()
+
+            for index in indices:
+                report(index, error)
+
+    finally:
+        for task in workers:
+            task.cancel()
+
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    return failed
+
+
+async def process_file(
+    file_content: str,
+    key: str,
+    outputs: List[Tuple[Path, SourceEncoding]],
+    model: genai.GenerativeModel,
+    doc_code: Optional[str] = None,
+) -> str:
+    """
+    Documents one file content and writes the result to every file that has it.
+
+    Args:
+        file_content (str): The code to document.
+        key (str): The cache key of `file_content`, see `cache_key`.
+        outputs (List[Tuple[Path, SourceEncoding]]): The resolved paths to write the documented
+            code to, each with the encoding of its source.
+        model (genai.GenerativeModel): The generative AI model to use for documentation.
+        doc_code (Optional[str]): Already generated documentation. If not provided, the model is called.
+
+    Returns:
+        str: The documented code.
+    """
+
+    if doc_code is None:
+        response = await model.generate_content_async(file_content, stream=True)
+        doc_code = await stream_to_file(response, *outputs[0])
+        await asyncio.to_thread(write_cache, key, doc_code)
+        outputs = outputs[1:]
+
+    for output_file, encoding in outputs:
+        await asyncio.to_thread(write_atomic, output_file, doc_code, encoding)
+
+    return doc_code
+
+
+async def stream_to_file(
+    response: AsyncIterable[Any],
+    output_file: Path,
+    encoding: SourceEncoding = UTF8,
+) -> str:
+    """
+    Writes a streamed answer of the model to `output_file` while it is generated.
+
+    The chunks are written to a temporary file next to `output_file`, which only
+    replaces it once the whole answer was received.
+
+    Raises:
+        RuntimeError: If the answer was cut off or blocked. `output_file` is left untouched.
+
+    Args:
+        response (AsyncIterable[Any]): The streamed answer, as returned by `generate_content_async(..., stream=True)`.
+        output_file (Path): The path of the file to write.
+        encoding (SourceEncoding): The encoding to write the file in, see `read_source`.
+
+    Returns:
+        str: The written code.
+    """
+
+    fd, tmp_file = await asyncio.to_thread(create_temporary, output_file)
+    parts: List[str] = []
+
+    try:
+        with open_encoded(fd, encoding) as out_file:
+            async for chunk in response:
+                await asyncio.to_thread(out_file.write, chunk.text)
+                parts.append(chunk.text)
+
+        if not finished_normally(response):
+            raise RuntimeError(
+                f"the model did not finish its answer ({finish_reason_name(response)})"
+            )
+
+        await asyncio.to_thread(replace_file, tmp_file, output_file)
+
+    finally:
+        tmp_file.unlink(missing_ok=True)
+
+    return "".join(parts)
+
+
+def read_source(
+    file: Path, strict: bool = False
+) -> Tuple[str, Dict[str, Any], SourceEncoding]:
+    """
+    Reads the code of `file` in a single call and decodes it once.
+
+    UTF-8 and UTF-16 byte order marks are recognized, anything else is decoded as UTF-8.
+
+    Args:
+        file (Path): The path of the file to read.
+        strict (bool): Whether undecodable bytes are an error. Otherwise they are replaced,
+            which is only acceptable when the original file is not overwritten.
+
+    Returns:
+        Tuple[str, Dict[str, Any], SourceEncoding]: The code of the file, the state of the
+        bytes that were read as recorded by `write_sidecar`, and the encoding to write the
+        documented code back in.
+
+    Raises:
+        UnicodeDecodeError: If `strict` and the file is not valid in its encoding.
+    """
+
+    with open(file, "rb") as source:
+        stat = os.fstat(source.fileno())
+        data = source.read()
+
+    state = {
+        "src_sha256": hashlib.sha256(data).hexdigest(),
+        "src_mtime_ns": stat.st_mtime_ns,
+        "src_size": stat.st_size,
+    }
+
+    errors = "strict" if strict else "replace"
+
+    for bom, codec in BOMS:
+        if data.startswith(bom):
+            return data[len(bom) :].decode(codec, errors=errors), state, (codec, True)
+
+    return data.decode("utf-8", errors=errors), state, UTF8
+
+
+def open_encoded(fd: int, encoding: SourceEncoding) -> TextIO:
+    """
+    Opens the descriptor `fd` for writing text in `encoding`, starting with its BOM if it has one.
+    """
+
+    codec, bom = encoding
+    out_file = os.fdopen(fd, "w", encoding=codec)
+
+    if bom:
+        out_file.write("\ufeff")
+
+    return out_file
+
+
+def sidecar_path(output_file: Path) -> Path:
+    """
+    Returns the path of the file recording which source `output_file` was generated from.
+    """
+
+    return output_file.with_name(f"{output_file.name}.docsai.json")
+
+
+def is_up_to_date(
+    file: Path, output_file: Path, language: str, model_name: str
+) -> bool:
+    """
+    Checks whether `output_file` was already generated from the current `file`.
+
+    The source is only hashed when its modification time or size changed since the
+    documentation was generated, so unchanged files cost a few `stat` calls.
+
+    Args:
+        file (Path): The resolved path of the file to document.
+        output_file (Path): The resolved path of the documented file.
+        language (str): Language of the documentation.
+        model_name (str): Name of the model that generates the documentation.
+
+    Returns:
+        bool: True if the documentation can be kept as it is.
+    """
+
+    try:
+        sidecar = json.loads(sidecar_path(output_file).read_text(encoding="utf-8"))
+        source = file.stat()
+        output = output_file.stat()
+    except (OSError, ValueError):
+        return False
+
+    if sidecar.get("lang") != language or sidecar.get("model") != model_name:
+        return False
+
+    if output.st_mtime_ns < source.st_mtime_ns:
+        return False
+
+    if (
+        sidecar.get("src_mtime_ns") == source.st_mtime_ns
+        and sidecar.get("src_size") == source.st_size
+    ):
+        return True
+
+    return sidecar.get("src_sha256") == file_sha256(file)
+
+
+def write_sidecar(
+    output_file: Path, language: str, model_name: str, state: Dict[str, Any]
+) -> None:
+    """
+    Records which source `output_file` has been generated from.
+
+    Args:
+        output_file (Path): The resolved path of the documented file.
+        language (str): Language of the documentation.
+        model_name (str): Name of the model that generated the documentation.
+        state (Dict[str, Any]): The state of the source when it was read, see `read_source`.
+            With `--replace` it is the state of the written file, so the next run sees it as up to date.
+    """
+
+    sidecar = {**state, "lang": language, "model": model_name}
+
+    write_atomic(sidecar_path(output_file), json.dumps(sidecar))
+
+
+def file_state(file: Path) -> Dict[str, Any]:
+    """
+    Returns the current state of `file`, in the format of `read_source`.
+    """
+
+    stat = file.stat()
+
+    return {
+        "src_sha256": file_sha256(file),
+        "src_mtime_ns": stat.st_mtime_ns,
+        "src_size": stat.st_size,
+    }
+
+
+def file_sha256(file: Path) -> str:
+    """
+    Returns the SHA-256 hex digest of the content of `file`.
+    """
+
+    with open(file, "rb") as source:
+        return hashlib.file_digest(source, "sha256").hexdigest()
+
+
+def create_temporary(output_file: Path) -> Tuple[int, Path]:
+    """
+    Creates the file `output_file` is written to before being renamed over it.
+
+    The name is unique and hidden, so it never clashes with a user file or another run.
+
+    Args:
+        output_file (Path): The path of the file that will be written.
+
+    Returns:
+        Tuple[int, Path]: The open descriptor and the path of the temporary file.
+    """
+
+    fd, tmp_name = tempfile.mkstemp(
+        dir=output_file.parent, prefix=f".{output_file.name}.", suffix=".tmp"
+    )
+
+    return fd, Path(tmp_name)
+
+
+@lru_cache(maxsize=1)
+def current_umask() -> int:
+    """
+    Returns the umask of the process, which `os.umask` can only read by setting it.
+    """
+
+    umask = os.umask(0)
+    os.umask(umask)
+
+    return umask
+
+
+def write_atomic(
+    output_file: Path, doc_code: str, encoding: SourceEncoding = UTF8
+) -> None:
+    """
+    Writes `doc_code` to `output_file` through a temporary file and an atomic rename.
+
+    If writing fails, `output_file` keeps its previous content instead of being left
+    half written, which matters when it is the original source file. The data is not
+    fsynced, so this does not protect against a power loss.
+
+    Args:
+        output_file (Path): The path of the file to write.
+        doc_code (str): The documented code.
+        encoding (SourceEncoding): The encoding to write the file in, see `read_source`.
+    """
+
+    fd, tmp_file = create_temporary(output_file)
+
+    try:
+        with open_encoded(fd, encoding) as out_file:
+            out_file.write(doc_code)
+
+        replace_file(tmp_file, output_file)
+
+    finally:
+        tmp_file.unlink(missing_ok=True)
+
+
+def replace_file(tmp_file: Path, output_file: Path) -> None:
+    """
+    Renames `tmp_file` over `output_file`, keeping the permissions `output_file` had.
+
+    New files get the usual permissions for the umask instead of the private ones of `tempfile.mkstemp`.
+
+    Args:
+        tmp_file (Path): The fully written temporary file.
+        output_file (Path): The path of the file to replace.
+    """
+
+    try:
+        shutil.copymode(output_file, tmp_file)
+    except FileNotFoundError:
+        os.chmod(tmp_file, 0o666 & ~current_umask())
+
+    os.replace(tmp_file, output_file)
+
+
+async def batch_generate(
+    sources: Dict[str, Tuple[str, str]],
+    model: genai.GenerativeModel,
+) -> Dict[str, str]:
+    """
+    Documents several files with a single request to the model.
+
+    Args:
+        sources (Dict[str, Tuple[str, str]]): The name and code of each file, keyed by their cache key.
+        model (genai.GenerativeModel): The generative AI model to use for documentation.
+
+    Returns:
+        Dict[str, str]: The documented code of each file, keyed by its cache key.
+        Files missing from the response are left out so they can be documented one by one.
+    """
+
+    keys = list(sources)
+    prompt = [BATCH_PROMPT]
+
+    for index, key in enumerate(keys):
+        name, file_content = sources[key]
+        prompt.append(f"\n===FILE {index}: {name}===\n{file_content}")
+
+    response = await model.generate_content_async("".join(prompt))
+    complete = finished_normally(response)
+
+    docs: Dict[str, str] = {}
+
+    for index, doc_code in parse_batch_response(
+        response.text, len(keys), complete
+    ).items():
+        docs[keys[index]] = doc_code
+        await asyncio.to_thread(write_cache, keys[index], doc_code)
+
+    return docs
+
+
+def finished_normally(response: Any) -> bool:
+    """
+    Checks whether the model stopped on its own, rather than being cut off or blocked.
+    """
+
+    return (
+        bool(response.candidates)
+        and response.candidates[0].finish_reason
+        == genai.protos.Candidate.FinishReason.STOP
+    )
+
+
+def finish_reason_name(response: Any) -> str:
+    """
+    Returns a readable name for the reason the model stopped answering.
+    """
+
+    if not response.candidates:
+        return "no answer"
+
+    reason = response.candidates[0].finish_reason
+
+    return getattr(reason, "name", str(reason))
+
+
+def split_batches(
+    sources: Dict[str, Tuple[str, str]],
+) -> List[Dict[str, Tuple[str, str]]]:
+    """
+    Splits the files to document in batches small enough for a single answer of the model.
+
+    A batch holds at most `BATCH_MAX_FILES` files and `BATCH_MAX_CHARS` characters of code,
+    except when a single file is larger, which then gets a batch of its own.
+
+    Args:
+        sources (Dict[str, Tuple[str, str]]): The name and code of each file, keyed by their cache key.
+
+    Returns:
+        List[Dict[str, Tuple[str, str]]]: The batches, in the order of `sources`.
+    """
+
+    batches: List[Dict[str, Tuple[str, str]]] = []
+    batch: Dict[str, Tuple[str, str]] = {}
+    size = 0
+
+    for key, (name, file_content) in sources.items():
+        if batch and (
+            len(batch) == BATCH_MAX_FILES or size + len(file_content) > BATCH_MAX_CHARS
+        ):
+            batches.append(batch)
+            batch, size = {}, 0
+
+        batch[key] = (name, file_content)
+        size += len(file_content)
+
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+
+def parse_batch_response(response: str, count: int, complete: bool) -> Dict[int, str]:
+    """
+    Splits the answer to a batched request into the documented code of each file.
+
+    Args:
+        response (str): The text of the answer.
+        count (int): How many files were sent in the request.
+        complete (bool): Whether the model finished its answer normally. If not, the
+            last file of the answer is dropped because it may have been cut off.
+
+    Returns:
+        Dict[int, str]: The documented code of each file, keyed by its position in the request.
+        Files missing or empty in the answer, and unknown positions, are left out.
+    """
+
+    sections = BATCH_MARKER.split(response)
+    positions = range(1, len(sections) - 1, 2)
+
+    if not complete:
+        positions = positions[:-1]
+
+    docs: Dict[int, str] = {}
+
+    for position in positions:
+        index = int(sections[position])
+        doc_code = sections[position + 1].strip("\n")
+
+        if index < count and doc_code:
+            docs[index] = doc_code
+
+    return docs
+
+
+def cache_key(file_content: str, language: str, model_name: str) -> str:
+    """
+    Builds the cache key of a generated documentation.
+
+    The prompts sent along with the code, and `CACHE_VERSION`, are part of the key too,
+    so changing them invalidates the entries generated with the old ones.
+
+    Args:
+        file_content (str): The code sent to the model.
+        language (str): Language of the documentation.
+        model_name (str): Name of the model that generates the documentation.
+
+    Returns:
+        str: The SHA-256 hex digest of the length-prefixed values.
+    """
+
+    digest = hashlib.sha256()
+
+    for field in (
+        str(CACHE_VERSION),
+        system_instruction(language),
+        BATCH_PROMPT,
+        file_content,
+        language,
+        model_name,
+    ):
+        data = field.encode()
+        digest.update(len(data).to_bytes(8, "big"))
+        digest.update(data)
+
+    return digest.hexdigest()
+
+
+def read_cache(key: str) -> Optional[str]:
+    """
+    Returns the cached documentation for `key`, or None if it was never generated.
+    """
+
+    try:
+        return (CACHE_DIR / f"{key}.txt").read_text(encoding="utf-8")
+    except FileNotFoundError:
+        return None
+
+
+def write_cache(key: str, doc_code: str) -> None:
+    """
+    Stores the documentation for `key`, replacing the cache entry atomically.
+    """
+
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    write_atomic(CACHE_DIR / f"{key}.txt", doc_code)
 
 
 if __name__ == "__main__":
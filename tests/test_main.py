@@ -0,0 +1,321 @@
+import asyncio
+import os
+import tomllib
+from types import SimpleNamespace
+
+import google.generativeai as genai
+import pytest
+
+import docsai.main
+from docsai.main import (
+    BATCH_MARKER,
+    BATCH_MAX_CHARS,
+    BATCH_MAX_FILES,
+    cache_key,
+    clear_config_cache,
+    document_files,
+    file_state,
+    is_up_to_date,
+    load_config,
+    parse_batch_response,
+    read_source,
+    sidecar_path,
+    split_batches,
+    split_existing_files,
+    write_sidecar,
+)
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+        self.candidates = [
+            SimpleNamespace(finish_reason=genai.protos.Candidate.FinishReason.STOP)
+        ]
+
+    def __aiter__(self):
+        return self.chunks()
+
+    async def chunks(self):
+        yield SimpleNamespace(text=self.text)
+
+
+class FakeModel:
+    model_name = "models/fake"
+
+    def __init__(self):
+        self.calls = []
+
+    async def generate_content_async(self, content, stream=False):
+        self.calls.append(content)
+
+        if stream:
+            return FakeResponse(f"# doc\n{content}")
+
+        sections = BATCH_MARKER.split(content)
+        answer = "".join(
+            f"===FILE {sections[position]}: file===\n# doc{sections[position + 1]}"
+            for position in range(1, len(sections) - 1, 2)
+        )
+        return FakeResponse(answer)
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(docsai.main, "CACHE_DIR", tmp_path / "cache")
+    return tmp_path / "cache"
+
+
+def run(files, model, replace=False, cache=True):
+    return asyncio.run(
+        document_files(
+            files=files, replace=replace, model=model, language="english", cache=cache
+        )
+    )
+
+
+def test_parse_batch_response_splits_on_markers():
+    response = (
+        "===FILE 0: a.py===\n# doc a\na = 1\n===FILE 1: b.py===\n# doc b\nb = 2\n"
+    )
+
+    assert parse_batch_response(response, 2, True) == {
+        0: "# doc a\na = 1",
+        1: "# doc b\nb = 2",
+    }
+
+
+def test_parse_batch_response_ignores_text_before_first_marker():
+    response = "Here is the code:\n===FILE 0: a.py===\na = 1\n"
+
+    assert parse_batch_response(response, 1, True) == {0: "a = 1"}
+
+
+def test_parse_batch_response_skips_out_of_range_indices():
+    response = "===FILE 0: a.py===\na = 1\n===FILE 5: z.py===\nz = 1\n"
+
+    assert parse_batch_response(response, 2, True) == {0: "a = 1"}
+
+
+def test_parse_batch_response_skips_empty_sections():
+    response = "===FILE 0: a.py===\n\n===FILE 1: b.py===\nb = 2\n"
+
+    assert parse_batch_response(response, 2, True) == {1: "b = 2"}
+
+
+def test_parse_batch_response_without_markers():
+    assert parse_batch_response("a = 1\n", 2, True) == {}
+
+
+def test_parse_batch_response_drops_last_section_when_cut_off():
+    response = "===FILE 0: a.py===\na = 1\n===FILE 1: b.py===\n# doc b\ndef b("
+
+    assert parse_batch_response(response, 2, False) == {0: "a = 1"}
+
+
+def test_split_batches_caps_file_count():
+    sources = {str(index): (f"{index}.py", "x = 1\n") for index in range(20)}
+
+    batches = split_batches(sources)
+
+    assert [len(batch) for batch in batches] == [BATCH_MAX_FILES, BATCH_MAX_FILES, 4]
+    assert [key for batch in batches for key in batch] == list(sources)
+
+
+def test_split_batches_caps_size():
+    half = "x" * (BATCH_MAX_CHARS // 2 + 1)
+    sources = {"a": ("a.py", half), "b": ("b.py", half), "c": ("c.py", "y")}
+
+    assert [list(batch) for batch in split_batches(sources)] == [["a"], ["b", "c"]]
+
+
+def test_split_batches_keeps_large_file_alone():
+    sources = {"big": ("big.py", "x" * (BATCH_MAX_CHARS * 2)), "a": ("a.py", "a")}
+
+    assert [list(batch) for batch in split_batches(sources)] == [["big"], ["a"]]
+
+
+def test_split_existing_files(tmp_path):
+    (tmp_path / "a.py").write_text("a = 1\n")
+    (tmp_path / "sub").mkdir()
+    files = [
+        tmp_path / "a.py",
+        tmp_path / "missing.py",
+        tmp_path / "sub",
+        tmp_path / "nope" / "b.py",
+    ]
+
+    assert split_existing_files(files) == ([files[0]], files[1:])
+
+
+def test_cache_key_separates_fields():
+    assert cache_key("ab", "c", "model") != cache_key("a", "bc", "model")
+    assert cache_key("a", "english", "model") == cache_key("a", "english", "model")
+
+
+def test_cache_hit_miss_and_no_cache(tmp_path, cache_dir):
+    source = tmp_path / "a.py"
+    source.write_text("a = 1\n")
+    output = tmp_path / "doc_a.py"
+    model = FakeModel()
+
+    assert run([source], model) is False
+    assert len(model.calls) == 1
+    assert output.read_text() == "# doc\na = 1\n"
+    assert len(list(cache_dir.iterdir())) == 1
+
+    output.unlink()
+    sidecar_path(output).unlink()
+
+    run([source], model)
+    assert len(model.calls) == 1
+    assert output.read_text() == "# doc\na = 1\n"
+
+    run([source], model, cache=False)
+    assert len(model.calls) == 2
+
+    source.write_text("a = 2\n")
+    run([source], model)
+    assert len(model.calls) == 3
+    assert output.read_text() == "# doc\na = 2\n"
+
+
+def test_load_config_parses_each_version_once(tmp_path, monkeypatch):
+    parsed = []
+    parse = tomllib.loads
+
+    def loads(text):
+        parsed.append(text)
+        return parse(text)
+
+    monkeypatch.setattr(docsai.main.tomllib, "loads", loads)
+    clear_config_cache()
+    config_path = tmp_path / "docsai.toml"
+    config_path.write_text('[API]\nAPI_KEY = "first"\n')
+
+    assert load_config(config_path) == "first"
+    assert load_config(config_path) == "first"
+    assert len(parsed) == 1
+
+    mtime_ns = config_path.stat().st_mtime_ns
+    config_path.write_text('[API]\nAPI_KEY = "second"\n')
+    os.utime(config_path, ns=(mtime_ns + 1_000_000, mtime_ns + 1_000_000))
+
+    assert load_config(config_path) == "second"
+    assert len(parsed) == 2
+
+    clear_config_cache()
+
+    assert load_config(config_path) == "second"
+    assert len(parsed) == 3
+
+
+@pytest.fixture
+def documented(tmp_path):
+    source = tmp_path / "a.py"
+    source.write_text("a = 1\n")
+    output = tmp_path / "doc_a.py"
+    output.write_text("# doc\na = 1\n")
+    write_sidecar(output, "english", "model", read_source(source)[1])
+    return source, output
+
+
+def set_mtime_ns(path, mtime_ns):
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_is_up_to_date(documented):
+    source, output = documented
+
+    assert is_up_to_date(source, output, "english", "model")
+
+
+def test_is_up_to_date_without_sidecar(documented):
+    source, output = documented
+    sidecar_path(output).unlink()
+
+    assert not is_up_to_date(source, output, "english", "model")
+
+
+def test_is_up_to_date_language_or_model_mismatch(documented):
+    source, output = documented
+
+    assert not is_up_to_date(source, output, "spanish", "model")
+    assert not is_up_to_date(source, output, "english", "other-model")
+
+
+def test_is_up_to_date_output_older_than_source(documented):
+    source, output = documented
+    set_mtime_ns(output, source.stat().st_mtime_ns - 1_000_000)
+
+    assert not is_up_to_date(source, output, "english", "model")
+
+
+def test_is_up_to_date_mtime_changed_same_content(documented):
+    source, output = documented
+    mtime_ns = source.stat().st_mtime_ns + 1_000_000
+    set_mtime_ns(source, mtime_ns)
+    set_mtime_ns(output, mtime_ns)
+
+    assert is_up_to_date(source, output, "english", "model")
+
+
+def test_is_up_to_date_content_changed(documented):
+    source, output = documented
+    mtime_ns = source.stat().st_mtime_ns
+    source.write_text("a = 2\n")
+    set_mtime_ns(source, mtime_ns + 1_000_000)
+    set_mtime_ns(output, mtime_ns + 1_000_000)
+
+    assert not is_up_to_date(source, output, "english", "model")
+
+
+def test_file_state_matches_read_source(documented):
+    source, _ = documented
+
+    assert file_state(source) == read_source(source)[1]
+
+
+def test_replace_is_a_no_op_the_second_time(tmp_path):
+    source = tmp_path / "a.py"
+    source.write_text("a = 1\n")
+    model = FakeModel()
+
+    run([source], model, replace=True)
+    run([source], model, replace=True)
+
+    assert len(model.calls) == 1
+    assert source.read_text() == "# doc\na = 1\n"
+    assert is_up_to_date(source, source, "english", model.model_name)
+
+
+def test_identical_files_are_documented_once(tmp_path):
+    first = tmp_path / "a.py"
+    second = tmp_path / "b.py"
+    first.write_text("x = 1\n")
+    second.write_text("x = 1\n")
+    model = FakeModel()
+
+    assert run([first, second, first], model) is False
+
+    assert len(model.calls) == 1
+    assert (tmp_path / "doc_a.py").read_text() == "# doc\nx = 1\n"
+    assert (tmp_path / "doc_b.py").read_text() == "# doc\nx = 1\n"
+    assert sidecar_path(tmp_path / "doc_a.py").exists()
+    assert sidecar_path(tmp_path / "doc_b.py").exists()
+
+
+def test_distinct_files_share_one_batched_call(tmp_path):
+    files = [tmp_path / f"{name}.py" for name in "abc"]
+
+    for index, file in enumerate(files):
+        file.write_text(f"x = {index}\n")
+
+    model = FakeModel()
+
+    assert run(files + [files[0]], model) is False
+
+    assert len(model.calls) == 1
+
+    for index, file in enumerate(files):
+        assert (tmp_path / f"doc_{file.name}").read_text() == f"# doc\nx = {index}"